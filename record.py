@@ -8,15 +8,18 @@ Writes WAV files to a directory with a timestamp appended to the prompt id.
 """
 import argparse
 import logging
+import os
+import queue
 import re
 import shlex
+import signal
 import subprocess
 import threading
 import time
 import tkinter as tk
 import tkinter.messagebox
 import typing
-import wave
+from collections import deque
 from pathlib import Path
 from tkinter import filedialog, ttk
 
@@ -29,24 +32,24 @@ _ARCTIC_LINE = re.compile(r'^\s*\(\s*([^ ]+)\s+"([^"]+)"\s*\)\s*$')
 # Shared logger
 _LOGGER = logging.getLogger("record")
 
-# True if currectly recording
-_IS_RECORDING = False
-
-_RECORDING_DONE = threading.Event()
-
-_RECORDING_PATH = None
-
 _SAMPLE_RATE = 48000  # Hertz
 _SAMPLE_WIDTH_BYTES = 2  # bytes
 _SAMPLE_WIDTH_BITS = _SAMPLE_WIDTH_BYTES * 8
 _SAMPLE_CHANNELS = 2
 
+# Scheduling for recording process (best effort, needs CAP_SYS_NICE or root)
+_RECORD_FIFO_PRIORITY = 20
+_RECORD_NICENESS = -10
+
+# Seconds to wait for recording process to finish WAV file after SIGINT
+_RECORD_STOP_TIMEOUT = 5
+
 # Format strings for common recording commands.
 # Referenced by name with --record-command argument.
 # Overridden when not one of these names.
 _RECORD_COMMANDS = {
-    "arecord": "arecord -q -r {rate} -f S16_LE -c {channels} -D '{device}' -t raw",
-    "sox": "/usr/local/bin/rec -q -r {rate} -b {width_bits} -c {channels} -t raw -",
+    "arecord": "arecord -q -r {rate} -f S16_LE -c {channels} -D '{device}' -t wav '{path}'",
+    "sox": "/usr/local/bin/rec -q -r {rate} -b {width_bits} -c {channels} -t wav '{path}'",
 }
 
 # Format strings for common playback commands.
@@ -72,7 +75,8 @@ def main():
         "--record-command",
         default="arecord",
         help="arecord, sox, or format string for recording command. "
-        + "Takes {rate}, {width_bytes}, {width_bits}, {channles}, and {device}",
+        + "Takes {rate}, {width_bytes}, {width_bits}, {channels}, {device}, and "
+        + "{path} for WAV file. Must stop and finish WAV file on SIGINT.",
     )
     parser.add_argument(
         "--play-command",
@@ -83,13 +87,15 @@ def main():
     parser.add_argument(
         "--chunk-size",
         type=int,
-        default=2048,
-        help="Bytes per chunk to read from microphone",
+        help="Deprecated and ignored (recording command writes WAV file directly)",
     )
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.DEBUG)
 
+    if args.chunk_size is not None:
+        _LOGGER.warning("--chunk-size is deprecated and ignored")
+
     window = tk.Tk()
     window.title("Voice Recorder")
 
@@ -122,39 +128,74 @@ def main():
 
     # id -> text
     prompts: typing.Dict[str, str] = {}
-    with open(args.prompts, "r") as prompts_file:
-        for line in prompts_file:
-            line = line.strip()
-            if line:
-                # ( prompt_id "Text for prompt" )
-                match = _ARCTIC_LINE.match(line)
-                if match:
-                    prompt_id = match.group(1)
-                    prompt_text = match.group(2)
-                    prompts[prompt_id] = prompt_text
+    # Read and decode whole file at once
+    prompts_text = Path(args.prompts).read_bytes().decode("utf-8")
+    for line in prompts_text.splitlines():
+        line = line.strip()
+        if line:
+            # ( prompt_id "Text for prompt" )
+            prompt = parse_prompt(line)
+            if prompt:
+                prompt_id, prompt_text = prompt
+                prompts[prompt_id] = prompt_text
 
     assert prompts, "No prompts!"
     _LOGGER.debug("Loaded %s prompt(s)", len(prompts))
 
     # Remaining prompt ids
-    prompts_left: typing.List[str] = list(prompts.keys())
-    prompts_left.reverse()
+    prompts_left: typing.Deque[str] = deque(prompts.keys())
     # Total number of prompts
     total_prompts: int = len(prompts_left)
 
+    # Ids of prompts with existing WAV files (<prompt_id>_<timestamp>.wav)
+    done_prompt_ids: typing.Set[str] = {
+        wav_name.rsplit("_", 1)[0]
+        for wav_name in os.listdir(wav_dir)
+        if wav_name.endswith(".wav")
+    }
+
     # Current prompt id or None
     current_prompt_id: typing.Optional[str] = None
 
     # Last recorded WAV path or None
     last_wav_path: typing.Optional[Path] = None
 
+    # Recording process (only while recording)
+    record_proc: typing.Optional[subprocess.Popen] = None
+
+    # Playback commands are run one at a time in a separate thread
+    play_queue: "queue.Queue" = queue.Queue()
+    play_thread = threading.Thread(target=play_proc, daemon=True, args=(play_queue,))
+    play_thread.start()
+
     # -------------------------------------------------------------------------
     # Record Samples
     # -------------------------------------------------------------------------
 
-    # Start recording thread
-    record_thread = threading.Thread(target=recording_proc, daemon=True, args=(args,))
-    record_thread.start()
+    # Split commands once; only {path} is substituted for each recording/playback
+    record_cmd_format = _RECORD_COMMANDS.get(args.record_command, args.record_command)
+    record_cmd_template = shlex.split(
+        record_cmd_format.format(
+            rate=_SAMPLE_RATE,
+            width_bytes=_SAMPLE_WIDTH_BYTES,
+            width_bits=_SAMPLE_WIDTH_BITS,
+            channels=_SAMPLE_CHANNELS,
+            device=args.device,
+            path="{path}",
+        )
+    )
+
+    assert any(
+        "{path}" in arg for arg in record_cmd_template
+    ), "Recording command must take {path} for WAV file"
+
+    play_cmd_format = _PLAY_COMMANDS.get(args.play_command, args.play_command)
+    play_cmd_template = shlex.split(play_cmd_format.format(path="{path}"))
+
+    record_env = {}
+    if args.device != "default":
+        # for sox
+        record_env["AUDIODEV"] = args.device
 
     # Text box with prompt text
     textbox = tk.Text(window, height=10, wrap=tk.WORD)
@@ -199,18 +240,12 @@ def main():
         next_button.config(style="grey.TButton")
         record_button.config(style="yellow.TButton")
 
-        if prompts_left:
-            # Find first unfinished prompts
-            wav_names = [wav_path.name for wav_path in wav_dir.glob("*.wav")]
-            current_prompt_id = prompts_left.pop()
-            wav_prefix = f"{current_prompt_id}_"
-            while has_wav(wav_names, wav_prefix):
-                current_prompt_id = None
-                if prompts_left:
-                    current_prompt_id = prompts_left.pop()
-                    wav_prefix = f"{current_prompt_id}_"
-                else:
-                    break
+        # Find first unfinished prompt
+        while prompts_left:
+            prompt_id = prompts_left.popleft()
+            if prompt_id not in done_prompt_ids:
+                current_prompt_id = prompt_id
+                break
 
         if current_prompt_id:
             # Show prompt text
@@ -227,29 +262,22 @@ def main():
     def do_play(*_args):
         """Play last recorded WAV file"""
         nonlocal last_wav_path
-        play_cmd_format = _PLAY_COMMANDS.get(args.play_command, args.play_command)
-
         print(last_wav_path)
         if last_wav_path and last_wav_path.is_file():
-            threading.Thread(
-                target=lambda: subprocess.check_call(
-                    shlex.split(
-                        play_cmd_format.format(path=str(last_wav_path.absolute()))
-                    )
-                )
-            ).start()
+            play_queue.put(with_path(play_cmd_template, last_wav_path))
 
     def do_record(*_args):
         """Toggle recording."""
-        global _IS_RECORDING, _RECORDING_DONE, _RECORDING_PATH
-        nonlocal last_wav_path
+        nonlocal last_wav_path, record_proc
 
-        if _IS_RECORDING:
-            # Stop recording and wait for signal
-            _IS_RECORDING = False
+        if record_proc is not None:
+            # Recording process should still be running until it's stopped here.
+            # Exit code isn't checked after SIGINT (arecord returns 1).
+            exit_code = record_proc.poll()
+            if exit_code is None:
+                stop_recording(record_proc)
 
-            _LOGGER.debug("Waiting for recording to end")
-            _RECORDING_DONE.wait()
+            record_proc = None
 
             window.config(background="#F0F0F0")
             record_button.config(style="greenactivered.TButton")
@@ -258,28 +286,46 @@ def main():
             next_button["state"] = tk.NORMAL
             next_button.config(style="yellow.TButton")
 
-            if current_prompt_id and last_wav_path:
+            if (exit_code is not None) or (
+                last_wav_path and (not last_wav_path.is_file())
+            ):
+                _LOGGER.error("Recording failed (exit code %s)", exit_code)
+                tkinter.messagebox.showerror(
+                    message="Recording failed. Check recording device and command."
+                )
+            elif current_prompt_id and last_wav_path:
+                done_prompt_ids.add(current_prompt_id)
+
                 # Write prompt text to file
                 text_path = last_wav_path.with_suffix(".txt")
                 text_path.write_text(prompts[current_prompt_id])
         else:
             # Start recording
             if current_prompt_id:
-                window.config(background="red")
-                record_button.config(style="activewhite.TButton")
-                record_button["text"] = "FINISH"
-                play_button["state"] = tk.DISABLED
-                next_button.config(style="grey.TButton")
-
                 last_wav_path = (
                     wav_dir / f"{current_prompt_id}_{time.time()}"
                 ).with_suffix(".wav")
 
-                # Signal other thread
-                _RECORDING_PATH = last_wav_path
-                _RECORDING_DONE.clear()
-                _IS_RECORDING = True
+                # Start recording process (writes WAV file itself)
+                record_cmd = with_path(record_cmd_template, last_wav_path)
+
+                _LOGGER.debug(record_cmd)
+                try:
+                    record_proc = subprocess.Popen(record_cmd, env=record_env)
+                except OSError as e:
+                    _LOGGER.exception("do_record")
+                    tkinter.messagebox.showerror(
+                        message=f"Unable to start recording: {e}"
+                    )
+                    return
+
+                raise_priority(record_proc.pid)
 
+                window.config(background="red")
+                record_button.config(style="activewhite.TButton")
+                record_button["text"] = "FINISH"
+                play_button["state"] = tk.DISABLED
+                next_button.config(style="grey.TButton")
             else:
                 tkinter.messagebox.showinfo(message="No prompt")
 
@@ -313,75 +359,96 @@ def main():
     window.bind("z", do_play)
     window.bind("w", do_play)
     window.bind("e", do_next)
-    window.mainloop()
+    try:
+        window.mainloop()
+    finally:
+        if record_proc is not None:
+            # Don't leave recording process running after window is closed
+            stop_recording(record_proc)
 
 
 # -----------------------------------------------------------------------------
 
 
-def recording_proc(args: argparse.Namespace):
-    """Drops audio chunks until recording"""
-    global _IS_RECORDING, _RECORDING_PATH, _RECORDING_DONE
-    try:
-        record_cmd_format = _RECORD_COMMANDS.get(
-            args.record_command, args.record_command
-        )
+def with_path(cmd_template: typing.List[str], path: Path) -> typing.List[str]:
+    """Substitutes {path} in a split command template."""
+    path_str = str(path.absolute())
+    return [arg.replace("{path}", path_str) for arg in cmd_template]
+
+
+# -----------------------------------------------------------------------------
 
-        record_cmd = shlex.split(
-            record_cmd_format.format(
-                rate=_SAMPLE_RATE,
-                width_bytes=_SAMPLE_WIDTH_BYTES,
-                width_bits=_SAMPLE_WIDTH_BITS,
-                channels=_SAMPLE_CHANNELS,
-                device=args.device,
-            )
-        )
 
-        _LOGGER.debug(record_cmd)
-
-        record_env = {}
-        if args.device != "default":
-            # for sox
-            record_env["AUDIODEV"] = args.device
-
-        # Start recording process
-        proc = subprocess.Popen(record_cmd, stdout=subprocess.PIPE, env=record_env)
-        assert proc.stdout, "No stdout"
-        record_wave_file = None
-
-        while True:
-            chunk = proc.stdout.read(args.chunk_size)
-            if _IS_RECORDING:
-                if record_wave_file is None:
-                    # Start recording to a WAV file
-                    assert _RECORDING_PATH, "No recording path"
-                    _LOGGER.debug("Recording to %s", _RECORDING_PATH)
-
-                    record_wave_file = wave.open(str(_RECORDING_PATH), "w")
-                    record_wave_file.setframerate(_SAMPLE_RATE)
-                    record_wave_file.setsampwidth(_SAMPLE_WIDTH_BYTES)
-                    record_wave_file.setnchannels(_SAMPLE_CHANNELS)
-
-                record_wave_file.writeframes(chunk)
-            elif record_wave_file:
-                # Close WAV file and signal completion
-                record_wave_file.close()
-                record_wave_file = None
-                _RECORDING_DONE.set()
-    except Exception:
-        _LOGGER.exception("recording_proc")
+def play_proc(play_queue: "queue.Queue"):
+    """Runs playback commands from queue"""
+    while True:
+        play_command = play_queue.get()
+        try:
+            _LOGGER.debug(play_command)
+            subprocess.check_call(play_command)
+        except Exception:
+            _LOGGER.exception("play_proc")
 
 
 # -----------------------------------------------------------------------------
 
 
-def has_wav(wav_names, wav_prefix):
-    """True if WAV file with prefix already exists."""
-    for wav_name in wav_names:
-        if wav_name.startswith(wav_prefix):
-            return True
+def stop_recording(proc: subprocess.Popen):
+    """Stops recording process and waits for WAV file to be closed."""
+    _LOGGER.debug("Waiting for recording to end")
+    proc.send_signal(signal.SIGINT)
+    try:
+        proc.wait(timeout=_RECORD_STOP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        _LOGGER.warning("Recording process did not stop on SIGINT. Killing it.")
+        proc.kill()
+        proc.wait()
+
+
+# -----------------------------------------------------------------------------
+
+
+def raise_priority(pid: int):
+    """Tries to give recording process real-time or higher priority."""
+    try:
+        os.sched_setscheduler(pid, os.SCHED_FIFO, os.sched_param(_RECORD_FIFO_PRIORITY))
+        _LOGGER.debug("Using SCHED_FIFO for recording process")
+        return
+    except (AttributeError, OSError):
+        # Not Linux or not permitted
+        pass
+
+    try:
+        os.setpriority(os.PRIO_PROCESS, pid, _RECORD_NICENESS)
+        _LOGGER.debug("Using niceness %s for recording process", _RECORD_NICENESS)
+    except (AttributeError, OSError):
+        _LOGGER.debug("Unable to raise priority of recording process")
+
+
+# -----------------------------------------------------------------------------
+
 
-    return False
+def parse_prompt(line: str) -> typing.Optional[typing.Tuple[str, str]]:
+    """Parses a stripped CMU Arctic prompt line into (id, text)."""
+    if line.startswith("(") and line.endswith(")"):
+        # Fast path for well-formed lines
+        prompt_id, _, prompt_text = line[1:-1].strip().partition(" ")
+        prompt_text = prompt_text.strip()
+        if (
+            prompt_id
+            and (len(prompt_text) > 2)
+            and prompt_text.startswith('"')
+            and prompt_text.endswith('"')
+            and ('"' not in prompt_text[1:-1])
+        ):
+            return prompt_id, prompt_text[1:-1]
+
+    # Fall back to regex
+    match = _ARCTIC_LINE.match(line)
+    if match:
+        return match.group(1), match.group(2)
+
+    return None
 
 
 # -----------------------------------------------------------------------------
@@ -9,6 +9,8 @@ Change prompt in text box to have different text written with Verify.
 """
 import argparse
 import logging
+import queue
+import struct
 import subprocess
 import threading
 import tkinter as tk
@@ -18,9 +20,11 @@ from pathlib import Path
 from tkinter import ttk
 
 import matplotlib
+import numpy as np
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
 from scipy.io.wavfile import read as wav_read
+from scipy.io.wavfile import write as wav_write
 
 matplotlib.use("TkAgg")
 
@@ -30,6 +34,9 @@ _DIR = Path(__file__).parent
 
 _LOGGER = logging.getLogger("verify")
 
+# Approximate number of points to plot for each WAV file
+_PLOT_POINTS = 4000
+
 
 # -----------------------------------------------------------------------------
 
@@ -84,9 +91,36 @@ def main():
     # Verify Samples
     # -------------------------------------------------------------------------
 
+    # Playback commands are run one at a time in a separate thread
+    play_queue: "queue.Queue" = queue.Queue()
+    play_thread = threading.Thread(target=play_proc, daemon=True, args=(play_queue,))
+    play_thread.start()
+
     window = tk.Tk()
     window.title("Sample Verifier")
 
+    # Verified samples are written in a separate thread.
+    # Holds (input path, output path, from sample, to sample, prompt path, prompt text)
+    verify_queue: "queue.Queue" = queue.Queue()
+
+    def on_verify_error(input_path: Path, error: Exception):
+        """Reports failed write of a verified sample (called from worker thread)."""
+        try:
+            window.after(
+                0,
+                lambda: tkinter.messagebox.showerror(
+                    message=f"Failed to save {input_path}: {error}"
+                ),
+            )
+        except (tk.TclError, RuntimeError):
+            # Window is already closed; error was logged
+            pass
+
+    verify_thread = threading.Thread(
+        target=verify_proc, daemon=True, args=(verify_queue, on_verify_error)
+    )
+    verify_thread.start()
+
     # Text box with prompt text
     textbox = tk.Text(window, height=3, wrap=tk.WORD)
     textbox.config(font=("Courier", 20))
@@ -117,31 +151,127 @@ def main():
     right_cut = None
 
     # Sample rate (Hz) of current WAV file
-    sample_rate = None
+    sample_rate: typing.Optional[int] = None
 
-    def redraw():
-        """Clears and re-draws WAV plot with trim lines."""
-        nonlocal sample_rate
+    # Trim lines (created when WAV data is drawn)
+    left_line = None
+    right_line = None
+
+    # Saved plot without trim lines (for blitting)
+    background = None
+
+    def reload():
+        """Clears WAV plot and loads current WAV file."""
+        nonlocal sample_rate, left_line, right_line, background
         plot.cla()
+        sample_rate = None
+        left_line = None
+        right_line = None
+        background = None
 
         if current_path:
             wav_path = input_dir / current_path
+
+            # Load in a separate thread
+            threading.Thread(target=load_wav, args=(wav_path,), daemon=True).start()
+
+        canvas.draw_idle()
+
+    def load_wav(wav_path: Path):
+        """Loads and decimates WAV data outside of the Tk thread."""
+        try:
             _LOGGER.debug("Loading %s", wav_path)
             wav_sample_rate, wav_data = wav_read(str(wav_path))
-            sample_rate = wav_sample_rate
 
             audio = wav_data[:, 0]
-            plot.plot(audio, color="blue")
-            plot.set_xlim(0, len(audio))
-
-            # Trim lines
-            if left_cut is not None:
-                plot.axvline(linewidth=2, x=left_cut, color="red")
-
-            if right_cut is not None:
-                plot.axvline(linewidth=2, x=right_cut, color="green")
+            num_samples = len(audio)
+
+            # Min/max envelope with roughly one point per pixel
+            step = max(1, num_samples // _PLOT_POINTS)
+            num_steps = num_samples // step
+            audio_steps = audio[: step * num_steps].reshape(-1, step)
+            envelope = (
+                np.arange(num_steps) * step,
+                audio_steps.min(axis=1),
+                audio_steps.max(axis=1),
+            )
+
+            window.after(
+                0, lambda: draw_wav(wav_path, wav_sample_rate, num_samples, envelope)
+            )
+        except Exception:
+            _LOGGER.exception("load_wav")
+
+    def draw_wav(wav_path: Path, wav_sample_rate: int, num_samples: int, envelope):
+        """Draws (x, min y, max y) envelope of WAV data with trim lines."""
+        nonlocal sample_rate, left_line, right_line, background
+        if (not current_path) or (wav_path != (input_dir / current_path)):
+            # Stale result
+            return
+
+        # Saved background is from before WAV data was drawn
+        background = None
+
+        _LOGGER.debug("Drawing %s", wav_path)
+        sample_rate = wav_sample_rate
+
+        plot_x, plot_min, plot_max = envelope
+        plot.fill_between(plot_x, plot_min, plot_max, color="blue")
+        plot.set_xlim(0, num_samples)
+
+        # Trim lines (animated, so they're left out of the background)
+        left_line = plot.axvline(
+            linewidth=2, x=0, color="red", visible=False, animated=True
+        )
+        right_line = plot.axvline(
+            linewidth=2, x=0, color="green", visible=False, animated=True
+        )
+        update_cuts(draw=False)
+
+        canvas.draw_idle()
+
+    def update_cuts(draw: bool = True):
+        """Moves trim lines without re-drawing WAV data."""
+        for line, cut in ((left_line, left_cut), (right_line, right_cut)):
+            if line is None:
+                continue
+
+            if cut is None:
+                line.set_visible(False)
+            else:
+                line.set_xdata([cut, cut])
+                line.set_visible(True)
+
+        if not draw:
+            return
+
+        if background is None:
+            canvas.draw_idle()
+        else:
+            # Only re-draw trim lines on top of saved plot
+            canvas.restore_region(background)
+            draw_cuts()
+            canvas.blit(plot.bbox)
+
+    def draw_cuts():
+        """Draws trim lines onto the canvas."""
+        for line in (left_line, right_line):
+            if line is not None:
+                plot.draw_artist(line)
+
+    def ondraw(_event):
+        """Saves plot without trim lines after a full draw."""
+        nonlocal background
+        background = canvas.copy_from_bbox(plot.bbox)
+        draw_cuts()
+
+    def get_sample_rate(wav_path: Path) -> int:
+        """Gets sample rate of current WAV file, reading only its header if needed."""
+        nonlocal sample_rate
+        if sample_rate is None:
+            sample_rate = read_sample_rate(wav_path)
 
-        canvas.draw()
+        return sample_rate
 
     def onclick(event):
         """Handles mouse clicks on plot."""
@@ -150,12 +280,13 @@ def main():
         if event.button == 1:
             # Left click
             left_cut = event.xdata
-            redraw()
+            update_cuts()
         elif (event.button == 2) and current_path:
             # Middle click
             wav_path = input_dir / current_path
             if wav_path and wav_path.is_file():
-                from_sec = event.xdata / sample_rate
+                wav_sample_rate = get_sample_rate(wav_path)
+                from_sec = event.xdata / wav_sample_rate
                 play_command = [
                     "play",
                     "--ignore-length",
@@ -165,17 +296,17 @@ def main():
                 ]
 
                 if right_cut is not None:
-                    to_sec = right_cut / sample_rate
+                    to_sec = right_cut / wav_sample_rate
                     play_command.append(f"={to_sec}")
-                threading.Thread(
-                    target=lambda: subprocess.check_call(play_command)
-                ).start()
+
+                play_queue.put(play_command)
         elif event.button == 3:
             # Right click
             right_cut = event.xdata
-            redraw()
+            update_cuts()
 
     canvas.mpl_connect("button_press_event", onclick)
+    canvas.mpl_connect("draw_event", ondraw)
 
     skip_button = None
     play_button = None
@@ -196,7 +327,7 @@ def main():
             textbox.delete(1.0, tk.END)
             textbox.insert(1.0, todo_prompts[current_path])
             path_label["text"] = str(wav_path)
-            redraw()
+            reload()
         else:
             tkinter.messagebox.showinfo(message="All done :)")
             path_label["text"] = ""
@@ -219,40 +350,44 @@ def main():
 
             if (left_cut is not None) or (right_cut is not None):
                 # Play clipped WAV file
-                from_sec = 0 if left_cut is None else (left_cut / sample_rate)
+                wav_sample_rate = get_sample_rate(wav_path)
+                from_sec = 0 if left_cut is None else (left_cut / wav_sample_rate)
                 play_command.extend(["trim", str(from_sec)])
 
                 if right_cut is not None:
-                    to_sec = right_cut / sample_rate
+                    to_sec = right_cut / wav_sample_rate
                     play_command.append(f"={to_sec}")
 
-            _LOGGER.debug(play_command)
-            threading.Thread(target=lambda: subprocess.check_call(play_command)).start()
+            play_queue.put(play_command)
             play_button.config(bg="green")
             verify_button.config(bg="yellow")
 
     def do_verify(*_args):
         """Verify recording."""
         if current_path:
+            # Trim in samples (None for end of file)
+            from_sample = 0 if left_cut is None else max(0, int(left_cut))
+            to_sample = None if right_cut is None else int(right_cut)
+            if (to_sample is not None) and (to_sample <= from_sample):
+                tkinter.messagebox.showinfo(message="Trim end is before trim start")
+                return
+
             input_path = input_dir / current_path
             output_path = output_dir / current_path
-            sox_command = ["sox", "--ignore-length", str(input_path), str(output_path)]
 
-            if (left_cut is not None) or (right_cut is not None):
-                # Write clipped WAV file
-                from_sec = 0 if left_cut is None else (left_cut / sample_rate)
-                sox_command.extend(["trim", str(from_sec)])
-
-                if right_cut is not None:
-                    to_sec = right_cut / sample_rate
-                    sox_command.append(f"={to_sec}")
-
-            _LOGGER.debug(sox_command)
-            subprocess.check_call(sox_command)
-
-            # Write prompt
+            # Write (clipped) WAV file and prompt
             prompt_path = output_dir / current_path.with_suffix(".txt")
-            prompt_path.write_text(textbox.get(1.0, tk.END).strip())
+            prompt_text = textbox.get(1.0, tk.END).strip()
+            verify_queue.put(
+                (
+                    input_path,
+                    output_path,
+                    from_sample,
+                    to_sample,
+                    prompt_path,
+                    prompt_text,
+                )
+            )
 
             do_next()
         else:
@@ -284,6 +419,90 @@ def main():
 
     window.mainloop()
 
+    # Finish writing verified samples
+    verify_queue.join()
+
+
+# -----------------------------------------------------------------------------
+
+
+def verify_proc(
+    verify_queue: "queue.Queue",
+    on_error: typing.Callable[[Path, Exception], typing.Any],
+):
+    """Writes verified WAV files and prompts from queue"""
+    while True:
+        (
+            input_path,
+            output_path,
+            from_sample,
+            to_sample,
+            prompt_path,
+            prompt_text,
+        ) = verify_queue.get()
+        try:
+            wav_sample_rate, wav_data = wav_read(str(input_path))
+
+            # Header with a wrong data size (e.g., unfinished recording) reads
+            # as empty.
+            assert len(wav_data) > 0, f"No audio in {input_path}"
+
+            if to_sample is None:
+                to_sample = len(wav_data)
+
+            assert to_sample > from_sample, f"Empty trim for {input_path}"
+
+            _LOGGER.debug(
+                "Writing %s (samples %s to %s)", output_path, from_sample, to_sample
+            )
+            wav_write(
+                str(output_path), wav_sample_rate, wav_data[from_sample:to_sample]
+            )
+            prompt_path.write_text(prompt_text)
+        except Exception as e:
+            _LOGGER.exception("verify_proc")
+            on_error(input_path, e)
+        finally:
+            verify_queue.task_done()
+
+
+# -----------------------------------------------------------------------------
+
+
+def play_proc(play_queue: "queue.Queue"):
+    """Runs playback commands from queue"""
+    while True:
+        play_command = play_queue.get()
+        try:
+            _LOGGER.debug(play_command)
+            subprocess.check_call(play_command)
+        except Exception:
+            _LOGGER.exception("play_proc")
+
+
+# -----------------------------------------------------------------------------
+
+
+def read_sample_rate(wav_path: Path) -> int:
+    """Reads sample rate (Hz) from WAV header without loading audio."""
+    with open(wav_path, "rb") as wav_file:
+        riff_header = wav_file.read(12)
+        assert riff_header[:4] == b"RIFF", f"Not a RIFF file: {wav_path}"
+        assert riff_header[8:12] == b"WAVE", f"Not a WAV file: {wav_path}"
+
+        # Find fmt chunk
+        while True:
+            chunk_header = wav_file.read(8)
+            assert len(chunk_header) == 8, f"No fmt chunk: {wav_path}"
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+            if chunk_id == b"fmt ":
+                # format, channels, sample rate
+                _, _, sample_rate = struct.unpack("<HHI", wav_file.read(8))
+                return sample_rate
+
+            # Chunks are padded to an even number of bytes
+            wav_file.seek(chunk_size + (chunk_size % 2), 1)
+
 
 # -----------------------------------------------------------------------------
 